@@ -6,13 +6,21 @@
 import os
 import asyncio
 import logging
+import functools
+import math
+import queue
+import re
+import html
 from datetime import datetime, timedelta
 from pathlib import Path
-import subprocess
 import json
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Set, Tuple
+from urllib.parse import urljoin
 import uuid
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 # ============================================
 # 🎯 KONFIGURATSIYA - RAILWAY ENVIRONMENT
@@ -25,20 +33,74 @@ CHANNEL_ID = os.getenv("CHANNEL_ID", "@Best_Studios")
 MAX_FILE_SIZE_GB = 1.8
 AUTO_UPLOAD_ON_STOP = True
 
+# Part bo'lish siyosati (standart qiymatlar, /record da o'zgartirish mumkin)
+MAX_PART_DURATION_MIN = float(os.getenv("MAX_PART_DURATION_MIN", "60"))
+TARGET_UPLOAD_MIN = float(os.getenv("TARGET_UPLOAD_MIN", "10"))
+UPLOAD_SPEED_MBPS = float(os.getenv("UPLOAD_SPEED_MBPS", "20"))  # o'lchashdan oldingi taxmin
+MIN_PART_DURATION_SEC = 60
+MIN_PART_SIZE_GB = 0.05
+MIN_TARGET_UPLOAD_MIN = 1
+SPLIT_SAFETY_MARGIN = 0.9  # bashorat qilingan kesish -fs chegarasidan oldin bo'lishi uchun
+BITRATE_SMOOTHING = 0.5  # bitrate o'lchovlari uchun EWMA koeffitsienti
+PART_TIMEOUT_GRACE_SEC = 120
+UPLOAD_PARTS_WHILE_RECORDING = True
+
+# Bir nechta yozuvni to'xtatishda finalizatsiya va yuklashlarni taqsimlash
+STOP_STAGGER_SEC = float(os.getenv("STOP_STAGGER_SEC", "15"))
+MAX_CONCURRENT_UPLOADS = int(os.getenv("MAX_CONCURRENT_UPLOADS", "1"))
+
+# HLS variant tanlash (0 - cheklovsiz)
+MAX_STREAM_BANDWIDTH_MBPS = float(os.getenv("MAX_STREAM_BANDWIDTH_MBPS", "0"))
+DISK_RESERVE_GB = float(os.getenv("DISK_RESERVE_GB", "1"))
+DISK_BUDGET_HOURS = float(os.getenv("DISK_BUDGET_HOURS", "24"))
+MAX_PLAYLIST_BYTES = 1024 * 1024
+
+# Sifat pasayganda pastroq variantga o'tish chegaralari (bitta part davomida)
+STEP_DOWN_SEGMENT_ERRORS = int(os.getenv("STEP_DOWN_SEGMENT_ERRORS", "5"))
+STEP_DOWN_DISCONTINUITIES = int(os.getenv("STEP_DOWN_DISCONTINUITIES", "10"))
+STEP_DOWN_STALLS = int(os.getenv("STEP_DOWN_STALLS", "1"))
+HLS_POLL_INTERVAL_SEC = float(os.getenv("HLS_POLL_INTERVAL_SEC", "10"))
+
 # Railway da temp papka
 OUTPUT_DIR = Path("/tmp/recordings")
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+# Fayl tizimi operatsiyalari uchun alohida thread pool
+FS_IO_WORKERS = int(os.getenv("FS_IO_WORKERS", "4"))
+
+# Log fayl rotatsiyasi
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "3"))
+
+# Event loop bloklanishini kuzatish (soniyalarda)
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "1.0"))
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", "0.5"))
+LOOP_LAG_ALERT_COOLDOWN = float(os.getenv("LOOP_LAG_ALERT_COOLDOWN", "300"))
+
 # ============================================
 # 📊 LOGGING - RAILWAY UCHUN
 # ============================================
 
+# Log faylga yozish event loop ni bloklamasligi uchun navbat orqali
+# alohida thread da bajariladi. QueueHandler yozuvni formatlab beradi,
+# shuning uchun fayl handleriga qo'shimcha formatter kerak emas.
+log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+log_file_handler = RotatingFileHandler(
+    OUTPUT_DIR / 'bot.log',
+    maxBytes=LOG_MAX_BYTES,
+    backupCount=LOG_BACKUP_COUNT,
+    encoding='utf-8'
+)
+log_file_handler.setFormatter(logging.Formatter('%(message)s'))
+log_listener = QueueListener(log_queue, log_file_handler)
+log_listener.start()
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
         logging.StreamHandler(sys.stdout),  # Railway loglari uchun
-        logging.FileHandler(OUTPUT_DIR / 'bot.log', encoding='utf-8')
+        QueueHandler(log_queue)
     ]
 )
 logger = logging.getLogger(__name__)
@@ -60,6 +122,7 @@ try:
     from aiogram.fsm.context import FSMContext
     from aiogram.fsm.state import State, StatesGroup
     from aiogram.fsm.storage.memory import MemoryStorage
+    import aiohttp
     logger.info("✅ Barcha kutubxonalar mavjud")
 except ImportError as e:
     logger.error(f"❌ Kutubxona yetishmayapti: {e}")
@@ -72,6 +135,21 @@ except ImportError as e:
 active_recordings: Dict[str, dict] = {}
 recorded_files: Dict[str, List[str]] = {}
 
+# Fayl tizimi operatsiyalari uchun cheklangan thread pool
+fs_executor = ThreadPoolExecutor(max_workers=FS_IO_WORKERS, thread_name_prefix="fs-io")
+
+# Fon vazifalari (event loop ularni faqat kuchsiz havola bilan saqlaydi)
+background_tasks: Set[asyncio.Task] = set()
+
+# Bir vaqtda bajariladigan send_video chaqiruvlari cheklovi (main() da yaratiladi)
+upload_semaphore: Optional[asyncio.Semaphore] = None
+
+# O'lchangan yuklash tezligi (bit/s)
+upload_stats: Dict[str, float] = {'bps': UPLOAD_SPEED_MBPS * 1_000_000}
+
+# Event loop kechikish statistikasi
+loop_lag_stats: Dict[str, float] = {'last': 0.0, 'max': 0.0}
+
 # ============================================
 # 🎬 FSM STATES
 # ============================================
@@ -80,6 +158,9 @@ class RecordState(StatesGroup):
     waiting_for_link = State()
     confirming = State()
 
+class ControlState(StatesGroup):
+    waiting_for_policy = State()
+
 # ============================================
 # 🔧 YORDAMCHI FUNKSIYALAR
 # ============================================
@@ -88,26 +169,40 @@ def check_admin(user_id: int) -> bool:
     """Adminlikni tekshirish"""
     return user_id == ADMIN_ID
 
-def get_stream_title(url: str) -> Optional[str]:
-    """Stream sarlavhasini olish"""
+async def get_stream_info(url: str) -> Tuple[Optional[str], Optional[int]]:
+    """Stream sarlavhasi va bitrate ini (bit/s) olish"""
+    title = None
+    bitrate = None
+    process = None
     try:
         cmd = [
             'ffprobe', '-v', 'quiet', '-print_format', 'json',
             '-show_format', '-timeout', '10000000', url
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout=10)
         
-        if result.returncode == 0:
-            data = json.loads(result.stdout)
-            title = data.get('format', {}).get('tags', {}).get('title', '')
-            if title:
+        if process.returncode == 0:
+            data = json.loads(stdout.decode('utf-8', errors='replace'))
+            fmt = data.get('format', {})
+            raw_title = fmt.get('tags', {}).get('title', '')
+            if raw_title:
                 # Faqat xavfsiz belgilarni qoldirish
-                title = "".join(c for c in title if c.isalnum() or c in (' ', '_', '-'))
-                return title.strip()
+                raw_title = "".join(c for c in raw_title if c.isalnum() or c in (' ', '_', '-'))
+                title = raw_title.strip() or None
+            if str(fmt.get('bit_rate', '')).isdigit():
+                bitrate = int(fmt['bit_rate']) or None
     except Exception as e:
         logger.warning(f"📺 Stream sarlavhasini olishda xato: {e}")
+        if process and process.returncode is None:
+            process.kill()
+            await process.wait()
     
-    return None
+    return title, bitrate
 
 def generate_filename(title: Optional[str] = None, part: int = 1) -> str:
     """Fayl nomini yaratish"""
@@ -121,12 +216,40 @@ def generate_filename(title: Optional[str] = None, part: int = 1) -> str:
     logger.debug(f"📄 Fayl nomi yaratildi: {filename}")
     return filename
 
-def get_file_size_gb(filepath: Path) -> float:
-    """Fayl hajmini GB da olish"""
-    if filepath.exists():
-        size_gb = filepath.stat().st_size / (1024 ** 3)
-        return round(size_gb, 2)
-    return 0.0
+async def run_fs(func, *args):
+    """Fayl tizimi operatsiyasini alohida thread pool da bajarish"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(fs_executor, functools.partial(func, *args))
+
+def get_file_size_bytes(filepath: Path) -> int:
+    """Fayl hajmini baytlarda olish (fayl yo'q bo'lsa 0)"""
+    try:
+        return filepath.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+def remove_file(filepath: Path):
+    """Faylni o'chirish"""
+    filepath.unlink(missing_ok=True)
+
+def list_recorded_files() -> List[tuple]:
+    """Yozilgan fayllar ro'yxati: (fayl, hajm GB, o'zgartirilgan vaqt), yangilari birinchi"""
+    files = []
+    for file in OUTPUT_DIR.glob("*.mp4"):
+        try:
+            stat = file.stat()
+        except FileNotFoundError:
+            continue
+        files.append((file, round(stat.st_size / (1024 ** 3), 2), stat.st_mtime))
+    files.sort(key=lambda x: x[2], reverse=True)
+    return files
+
+def get_disk_usage(path: str = '/tmp') -> tuple:
+    """Disk holati: (jami, foydalanilgan, bo'sh) GB da"""
+    disk_info = os.statvfs(path)
+    free_gb = (disk_info.f_bavail * disk_info.f_frsize) / (1024 ** 3)
+    total_gb = (disk_info.f_blocks * disk_info.f_frsize) / (1024 ** 3)
+    return total_gb, total_gb - free_gb, free_gb
 
 def format_duration(seconds: int) -> str:
     """Vaqtni formatlash"""
@@ -135,6 +258,463 @@ def format_duration(seconds: int) -> str:
     seconds = seconds % 60
     return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
 
+# ============================================
+# ✂️ PART BO'LISH SIYOSATI
+# ============================================
+
+SPLIT_POLICY_KEYS = {
+    'size': 'max_size_gb',
+    'duration': 'max_duration_min',
+    'upload': 'target_upload_min',
+    'live': 'upload_parts',
+}
+
+# 0 qiymati ruxsat etilgan parametrlar
+SPLIT_POLICY_ZERO_ALLOWED = {'upload', 'live'}
+
+# Musbat qiymatlar uchun minimal chegaralar
+SPLIT_POLICY_MINIMUMS = {
+    'size': MIN_PART_SIZE_GB,
+    'duration': MIN_PART_DURATION_SEC / 60,
+    'upload': MIN_TARGET_UPLOAD_MIN,
+}
+
+def default_split_policy() -> dict:
+    """Standart part bo'lish siyosati"""
+    return {
+        'max_size_gb': MAX_FILE_SIZE_GB,
+        'max_duration_min': MAX_PART_DURATION_MIN,
+        'target_upload_min': TARGET_UPLOAD_MIN,
+        'upload_parts': UPLOAD_PARTS_WHILE_RECORDING,
+    }
+
+def parse_split_policy(options: List[str], base: Optional[dict] = None) -> dict:
+    """
+    size=1.5 duration=30 upload=10 live=0 ko'rinishidagi parametrlardan siyosat
+    yaratish. upload=0 yuklash vaqti cheklovini o'chiradi, live=0 partlarni
+    faqat yozuv tugaganda yuklaydi. Noto'g'ri qiymatda ValueError.
+    """
+    policy = dict(base or default_split_policy())
+    
+    for option in options:
+        key, sep, value = option.partition('=')
+        if not sep or key.lower() not in SPLIT_POLICY_KEYS:
+            raise ValueError(f"Nomaʼlum parametr: {option}")
+        try:
+            number = float(value)
+        except ValueError:
+            raise ValueError(f"Raqam kutilgan: {option}")
+        if not math.isfinite(number):
+            raise ValueError(f"Chekli raqam kutilgan: {option}")
+        if number < 0 or (number == 0 and key.lower() not in SPLIT_POLICY_ZERO_ALLOWED):
+            raise ValueError(f"Musbat qiymat kutilgan: {option}")
+        minimum = SPLIT_POLICY_MINIMUMS.get(key.lower())
+        if number > 0 and minimum and number < minimum:
+            raise ValueError(f"{key} kamida {minimum:g} bo'lishi kerak: {option}")
+        if key.lower() == 'live':
+            policy['upload_parts'] = number > 0
+        else:
+            policy[SPLIT_POLICY_KEYS[key.lower()]] = number
+    
+    if policy['max_size_gb'] > MAX_FILE_SIZE_GB:
+        raise ValueError(f"Max hajm {MAX_FILE_SIZE_GB} GB dan oshmasligi kerak")
+    
+    return policy
+
+def parse_record_args(text: str) -> Tuple[str, dict]:
+    """'<url> [size=..] [duration=..] [upload=..]' matnidan URL va siyosatni ajratish"""
+    parts = text.split()
+    if not parts:
+        raise ValueError("URL ko'rsatilmagan")
+    return parts[0], parse_split_policy(parts[1:])
+
+def format_split_policy(policy: dict) -> str:
+    """Siyosatni qisqa matn ko'rinishida"""
+    text = f"{policy['max_size_gb']:g} GB / {policy['max_duration_min']:g} daq"
+    if policy['target_upload_min']:
+        text += f" / yuklash ≤ {policy['target_upload_min']:g} daq"
+    if not policy.get('upload_parts', UPLOAD_PARTS_WHILE_RECORDING):
+        text += " / yakunda yuklash"
+    return text
+
+def count_live_uploaders() -> int:
+    """Partlarni yozuv davomida yuklayotgan faol yozuvlar soni"""
+    return sum(
+        1 for info in active_recordings.values()
+        if not info.get('stopping')
+        and info['policy'].get('upload_parts', UPLOAD_PARTS_WHILE_RECORDING)
+    )
+
+def plan_next_part(policy: dict, ingest_bps: Optional[float]) -> dict:
+    """
+    Keyingi part uchun kesish nuqtasini bashorat qilish.
+    
+    Hajm chegarasi max hajm va maqsadli yuklash vaqti (o'lchangan yuklash
+    tezligining partlarni yozuv davomida yuklayotgan yozuvlar orasidagi
+    ulushi bo'yicha) ning kichigi. Davomiylik shu hajmni o'lchangan ingest
+    bitrate bilan to'ldirish vaqti, max davomiylikdan oshmaydi. Bitrate
+    noma'lum bo'lsa faqat max davomiylik va -fs cheklovi ishlaydi.
+    """
+    size_bytes = policy['max_size_gb'] * 1024 ** 3
+    reason = 'hajm'
+    
+    if policy['target_upload_min'] and upload_stats['bps'] > 0:
+        # send_video chaqiruvlari semafor orqali navbatda - tezlik bo'linadi
+        upload_share = upload_stats['bps'] / max(count_live_uploaders(), 1)
+        upload_bytes = upload_share / 8 * policy['target_upload_min'] * 60
+        if upload_bytes < size_bytes:
+            size_bytes = max(upload_bytes, MIN_PART_SIZE_GB * 1024 ** 3)
+            reason = 'yuklash vaqti'
+    
+    duration_sec = policy['max_duration_min'] * 60
+    if ingest_bps:
+        predicted_sec = size_bytes * 8 / ingest_bps * SPLIT_SAFETY_MARGIN
+        if predicted_sec < duration_sec:
+            duration_sec = predicted_sec
+        else:
+            reason = 'davomiylik'
+    elif reason == 'hajm':
+        # Bitrate noma'lum - hajm faqat -fs cheklovi, kesishni davomiylik belgilaydi
+        reason = 'davomiylik'
+    
+    return {
+        'size_bytes': int(size_bytes),
+        'duration_sec': int(max(duration_sec, MIN_PART_DURATION_SEC)),
+        'reason': reason,
+    }
+
+def update_bitrate(previous: Optional[float], size_bytes: int, seconds: float) -> Optional[float]:
+    """O'lchangan bitrate ni EWMA bilan yangilash"""
+    if seconds < 5 or size_bytes <= 0:
+        return previous
+    measured = size_bytes * 8 / seconds
+    if not previous:
+        return measured
+    return BITRATE_SMOOTHING * measured + (1 - BITRATE_SMOOTHING) * previous
+
+# ============================================
+# 📶 HLS VARIANTLAR VA SIFAT TELEMETRIYASI
+# ============================================
+
+M3U8_ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+# ffmpeg -loglevel warning da chiqaradigan aniq xabarlarni turkumlash.
+# Uzilishlar ffmpeg logida ko'rinmaydi - ular media playlist dagi
+# #EXT-X-DISCONTINUITY teglaridan sanaladi, stall lar esa part timeout idan.
+FFMPEG_LOG_PATTERNS = [
+    ('dts_warnings', re.compile(
+        r'non-monoton\w* dts|non monotonically increasing dts|'
+        r'dts -?\d+[^,]*invalid dropping|dts -?\d+ < -?\d+ out of order',
+        re.I
+    )),
+    ('segment_errors', re.compile(
+        r'failed to open segment|failed to reload playlist|'
+        r'segment \d+ of playlist \d+ failed too many times|'
+        r'http error \d{3}|server returned \d{3}|connection timed out|'
+        r'unable to open resource',
+        re.I
+    )),
+]
+
+QUALITY_COUNTERS = ('segment_errors', 'discontinuities', 'dts_warnings', 'stalls')
+
+# Bitta part davomida pastroq variantga o'tish chegaralari
+STEP_DOWN_THRESHOLDS = {
+    'segment_errors': STEP_DOWN_SEGMENT_ERRORS,
+    'discontinuities': STEP_DOWN_DISCONTINUITIES,
+    'stalls': STEP_DOWN_STALLS,
+}
+
+def new_quality_counters() -> Dict[str, int]:
+    """Bo'sh sifat hisoblagichlari"""
+    return {kind: 0 for kind in QUALITY_COUNTERS}
+
+def classify_ffmpeg_line(line: str) -> Optional[str]:
+    """ffmpeg log qatorining turini aniqlash"""
+    for kind, pattern in FFMPEG_LOG_PATTERNS:
+        if pattern.search(line):
+            return kind
+    return None
+
+def format_quality(counters: Dict[str, int]) -> str:
+    """Sifat hisoblagichlarini qisqa matn ko'rinishida"""
+    return (
+        f"Seg xato: {counters['segment_errors']} | "
+        f"Uzilish: {counters['discontinuities']} | "
+        f"DTS: {counters['dts_warnings']} | "
+        f"Stall: {counters['stalls']}"
+    )
+
+def parse_m3u8_attributes(line: str) -> Dict[str, str]:
+    """'#TAG:KEY=VALUE,...' qatoridan atributlarni olish"""
+    return {
+        key: value.strip('"')
+        for key, value in M3U8_ATTRIBUTE_RE.findall(line.split(':', 1)[1])
+    }
+
+def parse_hls_master(text: str, base_url: str) -> List[dict]:
+    """
+    HLS master playlist dan variantlarni olish (yuqori bitrate birinchi).
+    Audio alohida #EXT-X-MEDIA:TYPE=AUDIO rendition da bo'lsa, variantning
+    AUDIO guruhidagi standart (yoki birinchi) rendition URL i audio_url ga
+    yoziladi.
+    """
+    variants = []
+    audio_groups: Dict[str, List[Tuple[bool, str]]] = {}
+    attrs = None
+    
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-MEDIA:'):
+            media = parse_m3u8_attributes(line)
+            if media.get('TYPE') == 'AUDIO' and media.get('URI'):
+                audio_groups.setdefault(media.get('GROUP-ID', ''), []).append(
+                    (media.get('DEFAULT') == 'YES', urljoin(base_url, media['URI']))
+                )
+        elif line.startswith('#EXT-X-STREAM-INF:'):
+            attrs = parse_m3u8_attributes(line)
+        elif attrs is not None and line and not line.startswith('#'):
+            if attrs.get('BANDWIDTH', '').isdigit():
+                variants.append({
+                    'url': urljoin(base_url, line),
+                    'bandwidth': int(attrs['BANDWIDTH']),
+                    'resolution': attrs.get('RESOLUTION', ''),
+                    'audio_group': attrs.get('AUDIO'),
+                })
+            attrs = None
+    
+    # #EXT-X-MEDIA teglari variantlardan keyin kelishi ham mumkin
+    for variant in variants:
+        renditions = audio_groups.get(variant.pop('audio_group') or '', [])
+        defaults = [uri for is_default, uri in renditions if is_default]
+        variant['audio_url'] = (defaults or [uri for _, uri in renditions] or [None])[0]
+    
+    variants.sort(key=lambda v: v['bandwidth'], reverse=True)
+    return variants
+
+def count_new_discontinuities(text: str, last_sequence: Optional[int]) -> Tuple[int, Optional[int]]:
+    """
+    Media playlist dagi oldin ko'rilmagan #EXT-X-DISCONTINUITY lar soni va
+    oxirgi segment tartib raqami. last_sequence None bo'lsa (birinchi o'qish)
+    hech narsa sanalmaydi - faqat boshlang'ich nuqta olinadi.
+    """
+    sequence = 0
+    pending = False
+    count = 0
+    newest = last_sequence
+    
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            value = line.split(':', 1)[1]
+            sequence = int(value) if value.isdigit() else 0
+        elif line == '#EXT-X-DISCONTINUITY':
+            pending = True
+        elif line and not line.startswith('#'):
+            if last_sequence is not None and sequence > last_sequence and pending:
+                count += 1
+            if newest is None or sequence > newest:
+                newest = sequence
+            pending = False
+            sequence += 1
+    
+    return count, newest
+
+def looks_like_m3u8(head: bytes) -> bool:
+    """Javob boshi #EXTM3U bilan boshlanadimi"""
+    return head.decode('utf-8', errors='replace').lstrip('\ufeff \r\n').startswith('#EXTM3U')
+
+async def read_playlist_body(chunks) -> Optional[bytes]:
+    """
+    Playlist ni EOF gacha to'liq o'qish. Javob m3u8 bo'lmasa (masalan
+    cheksiz TS stream) birinchi baytlardanoq, MAX_PLAYLIST_BYTES dan
+    oshsa esa o'qish to'xtatiladi - chala playlist qaytarilmaydi.
+    """
+    body = b''
+    checked = False
+    
+    async for chunk in chunks:
+        body += chunk
+        if not checked and len(body.lstrip(b'\xef\xbb\xbf \r\n')) >= len(b'#EXTM3U'):
+            if not looks_like_m3u8(body):
+                return None
+            checked = True
+        if len(body) > MAX_PLAYLIST_BYTES:
+            return None
+    
+    if not looks_like_m3u8(body):
+        return None
+    return body
+
+async def fetch_playlist_text(session, url: str) -> Optional[Tuple[str, str]]:
+    """Playlist matni va yakuniy URL (m3u8 bo'lmasa None)"""
+    async with session.get(url) as response:
+        if response.status != 200:
+            return None
+        body = await read_playlist_body(response.content.iter_any())
+        base_url = str(response.url)
+    
+    if body is None:
+        return None
+    return body.decode('utf-8', errors='replace'), base_url
+
+async def fetch_hls_variants(url: str) -> List[dict]:
+    """URL HLS master playlist bo'lsa uning variantlarini qaytarish"""
+    if not url.lower().startswith(('http://', 'https://')):
+        return []
+    
+    try:
+        timeout = aiohttp.ClientTimeout(total=10)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            playlist = await fetch_playlist_text(session, url)
+    except Exception as e:
+        logger.warning(f"📶 Playlist ni olishda xato: {e}")
+        return []
+    
+    if playlist is None:
+        return []
+    
+    variants = parse_hls_master(*playlist)
+    if variants:
+        logger.info(f"📶 Master playlist: {len(variants)} ta variant")
+    return variants
+
+async def stream_budget_bps() -> Optional[float]:
+    """
+    Yangi yozuv uchun ruxsat etilgan ingest bitrate.
+    
+    Tarmoq cheklovi MAX_STREAM_BANDWIDTH_MBPS. Disk cheklovi: yuklash
+    tezligining shu yozuvga tegishli ulushi, ustiga bo'sh diskni
+    DISK_BUDGET_HOURS davomida to'ldiradigan ortiqcha - ingest yuklashdan
+    tez bo'lsa, yuklanmagan partlar diskda to'planib boradi.
+    """
+    limits = []
+    if MAX_STREAM_BANDWIDTH_MBPS:
+        limits.append(MAX_STREAM_BANDWIDTH_MBPS * 1_000_000)
+    
+    try:
+        _, _, free_gb = await run_fs(get_disk_usage, str(OUTPUT_DIR))
+    except OSError:
+        free_gb = None
+    
+    if free_gb is not None:
+        usable_bytes = max(free_gb - DISK_RESERVE_GB, 0) * 1024 ** 3
+        upload_share = upload_stats['bps'] / (len(active_recordings) + 1)
+        limits.append(upload_share + usable_bytes * 8 / (DISK_BUDGET_HOURS * 3600))
+    
+    return min(limits) if limits else None
+
+def select_variant(variants: List[dict], budget_bps: Optional[float]) -> int:
+    """Byudjetga sig'adigan eng yuqori variant indeksi (sig'masa eng pasti)"""
+    if budget_bps is None:
+        return 0
+    for i, variant in enumerate(variants):
+        if variant['bandwidth'] <= budget_bps:
+            return i
+    return len(variants) - 1
+
+def format_variant(variants: List[dict], index: int) -> str:
+    """Variantni qisqa matn ko'rinishida"""
+    variant = variants[index]
+    resolution = f"{variant['resolution']} · " if variant['resolution'] else ""
+    return f"{resolution}{variant['bandwidth'] / 1_000_000:.2f} Mbit/s ({index + 1}/{len(variants)})"
+
+def current_stream_url(info: dict, url: str) -> str:
+    """Yozuv uchun joriy manba URL (tanlangan variant yoki asl URL)"""
+    if info.get('variants'):
+        return info['variants'][info['variant_index']]['url']
+    return url
+
+def ffmpeg_input_args(info: dict, url: str) -> List[str]:
+    """
+    ffmpeg kirish parametrlari. Variant audiosi alohida rendition da bo'lsa,
+    u ikkinchi kirish sifatida qo'shiladi va oqimlar aniq tanlanadi.
+    """
+    args = ['-i', current_stream_url(info, url)]
+    if info.get('variants'):
+        audio_url = info['variants'][info['variant_index']].get('audio_url')
+        if audio_url:
+            args += ['-i', audio_url, '-map', '0:v', '-map', '1:a']
+    return args
+
+def can_step_down(info: dict) -> bool:
+    """Pastroq variant mavjudligi"""
+    return bool(info.get('variants')) and info['variant_index'] < len(info['variants']) - 1
+
+def step_down_variant(info: dict) -> Optional[dict]:
+    """Keyingi pastroq variantga o'tish"""
+    if not can_step_down(info):
+        return None
+    info['variant_index'] += 1
+    variant = info['variants'][info['variant_index']]
+    # Yangi variant bitrate i boshqacha - bashoratni qaytadan boshlash
+    info['ingest_bps'] = variant['bandwidth']
+    return variant
+
+def record_quality_event(info: dict, kind: str, count: int = 1):
+    """
+    Sifat hisoblagichini oshirish. Joriy partda chegaradan oshsa part
+    yakunlanadi va pastroq variant so'raladi.
+    """
+    part_counters = info['part_quality']
+    info['quality'][kind] += count
+    part_counters[kind] += count
+    
+    if info['step_down'] or not can_step_down(info):
+        return
+    if any(part_counters[k] >= limit for k, limit in STEP_DOWN_THRESHOLDS.items()):
+        logger.warning(f"📉 Manba variantni ko'tara olmayapti: {format_quality(part_counters)}")
+        info['step_down'] = True
+        terminate_part(info)
+
+async def monitor_ffmpeg_stderr(process, info: dict):
+    """
+    ffmpeg loglarini o'qib sifat hisoblagichlarini yangilash. Pipe to'lib
+    ffmpeg bloklanmasligi uchun EOF gacha o'qishda davom etadi.
+    """
+    while True:
+        try:
+            raw_line = await process.stderr.readline()
+        except ValueError:
+            # Limitdan uzun qator - StreamReader uni tashlab yuboradi
+            continue
+        if not raw_line:
+            break
+        
+        line = raw_line.decode('utf-8', errors='replace').strip()
+        if not line:
+            continue
+        
+        info['last_ffmpeg_line'] = line[:200]
+        kind = classify_ffmpeg_line(line)
+        if kind is None:
+            continue
+        
+        logger.debug(f"📉 ffmpeg ({kind}): {line[:120]}")
+        record_quality_event(info, kind)
+
+async def monitor_hls_discontinuities(playlist_url: str, info: dict):
+    """Tanlangan variant media playlist idagi yangi uzilishlarni sanash"""
+    last_sequence = None
+    timeout = aiohttp.ClientTimeout(total=10)
+    
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        while True:
+            try:
+                playlist = await fetch_playlist_text(session, playlist_url)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"📶 Media playlist ni o'qishda xato: {e}")
+                playlist = None
+            
+            if playlist is not None:
+                count, last_sequence = count_new_discontinuities(playlist[0], last_sequence)
+                if count:
+                    record_quality_event(info, 'discontinuities', count)
+            
+            await asyncio.sleep(HLS_POLL_INTERVAL_SEC)
+
 # ============================================
 # 🎥 YOZISH FUNKSIYALARI
 # ============================================
@@ -148,6 +728,13 @@ async def record_stream(
 ):
     """
     Asosiy yozish funksiyasi - 24/7 ishlaydi
+    
+    Har bir part uchun kesish nuqtasi yozuvning joriy siyosati va o'lchangan
+    ingest bitrate bo'yicha qayta hisoblanadi. Tugagan partlar yozuv davom
+    etayotganda kanalga yuklanadi, qolganlari yakunda yuklanadi.
+    
+    To'xtatish va pauza joriy ffmpeg process ini yakunlash orqali ishlaydi:
+    part to'liq yopiladi, keyin sikl to'xtaydi yoki resume ni kutadi.
     """
     logger.info(f"🎬 YANGI YOZUV BOSHlandi: {title}")
     logger.info(f"🔗 URL: {url[:50]}...")
@@ -155,14 +742,25 @@ async def record_stream(
     recorded_files[recording_id] = []
     part = 1
     session_start = datetime.now()
+    upload_lock = asyncio.Lock()
+    part_uploads: List[asyncio.Task] = []
+    info = active_recordings[recording_id]
     
     try:
-        while recording_id in active_recordings:
+        while recording_id in active_recordings and not info['stopping']:
             # Fayl nomi
             filename = generate_filename(title, part)
             output_path = OUTPUT_DIR / filename
             
-            logger.info(f"📹 Part {part} boshlandi: {filename}")
+            # Kesish nuqtasini bashorat qilish
+            plan = plan_next_part(info['policy'], info.get('ingest_bps'))
+            source_url = current_stream_url(info, url)
+            info['part_quality'] = new_quality_counters()
+            
+            logger.info(
+                f"📹 Part {part} boshlandi: {filename} "
+                f"(~{plan['duration_sec']}s, {plan['size_bytes']} B, {plan['reason']})"
+            )
             
             # Boshlanish xabari
             start_msg = await bot.send_message(
@@ -170,18 +768,24 @@ async def record_stream(
                 f"🎬 <b>Yozish boshlandi - Part {part}</b>\n\n"
                 f"📺 {title or 'Nomaʼlum'}\n"
                 f"📁 {filename}\n"
-                f"⏰ {datetime.now().strftime('%H:%M:%S')}\n"
+                f"✂️ ~{format_duration(plan['duration_sec'])} / "
+                f"{plan['size_bytes'] / (1024 ** 3):.2f} GB ({plan['reason']})\n"
+                + (f"🎚 {format_variant(info['variants'], info['variant_index'])}\n" if info.get('variants') else "")
+                + f"⏰ {datetime.now().strftime('%H:%M:%S')}\n"
                 f"📍 <i>Railway.app - 24/7</i>",
                 parse_mode='HTML'
             )
             
-            # FFmpeg buyrug'i
-            max_size_bytes = int(MAX_FILE_SIZE_GB * 1024 * 1024 * 1024)
+            # FFmpeg buyrug'i. Stream copy da boshidagi keyframe bo'lmagan
+            # paketlar tashlanadi, shuning uchun har bir part keyframe dan
+            # boshlanadi; -fs faqat bashorat xato bo'lganda ishlaydi.
             ffmpeg_cmd = [
                 'ffmpeg',
-                '-i', url,
+                '-nostats', '-loglevel', 'warning',  # Faqat sifat telemetriyasi uchun loglar
+                *ffmpeg_input_args(info, url),
                 '-c', 'copy',  # Transcode qilmaslik
-                '-fs', str(max_size_bytes),  # Max fayl hajmi
+                '-t', str(plan['duration_sec']),  # Bashorat qilingan davomiylik
+                '-fs', str(plan['size_bytes']),  # Max fayl hajmi
                 '-y',  # Faylni overwrite qilish
                 '-max_muxing_queue_size', '9999',  # Buffering muammolari uchun
                 str(output_path)
@@ -190,26 +794,70 @@ async def record_stream(
             logger.debug(f"🔧 FFmpeg buyrug'i: {' '.join(ffmpeg_cmd[:4])}...")
             
             # Process ni ishga tushirish
+            part_started = time.monotonic()
             process = await asyncio.create_subprocess_exec(
                 *ffmpeg_cmd,
-                stdout=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.DEVNULL,
                 stderr=asyncio.subprocess.PIPE
             )
+            stderr_task = asyncio.create_task(monitor_ffmpeg_stderr(process, info))
+            playlist_task = None
+            if info.get('variants'):
+                playlist_task = asyncio.create_task(monitor_hls_discontinuities(source_url, info))
+            info['process'] = process
+            info['part_started'] = part_started
+            info['part_plan'] = plan
+            
+            # Process ishga tushguncha to'xtatish yoki pauza so'ralgan bo'lishi mumkin
+            if info['stopping'] or info['paused']:
+                process.terminate()
             
             # Process ni kutish
             try:
-                await asyncio.wait_for(process.wait(), timeout=3600)  # 1 soat timeout
+                await asyncio.wait_for(
+                    process.wait(),
+                    timeout=plan['duration_sec'] + PART_TIMEOUT_GRACE_SEC
+                )
+                await stderr_task
             except asyncio.TimeoutError:
-                logger.warning(f"⏰ Part {part} timeout, keyingi partga o'tish")
+                # Yakunlangan part odatdagidek tekshiriladi va yuklanadi
+                logger.warning(f"⏰ Part {part} timeout, part yakunlanmoqda")
                 process.terminate()
-                continue
+                await process.wait()
+                # Stall - manba variantni ko'tara olmayotganining eng aniq belgisi
+                record_quality_event(info, 'stalls')
+            finally:
+                if not stderr_task.done():
+                    stderr_task.cancel()
+                if playlist_task:
+                    playlist_task.cancel()
+                info['process'] = None
+                if info.get('cut_handle'):
+                    info['cut_handle'].cancel()
+                    info['cut_handle'] = None
             
             # Natijani tekshirish
-            if output_path.exists() and output_path.stat().st_size > 0:
-                file_size = get_file_size_gb(output_path)
+            size_bytes = await run_fs(get_file_size_bytes, output_path)
+            if size_bytes > 0:
+                file_size = round(size_bytes / (1024 ** 3), 2)
                 recorded_files[recording_id].append(filename)
                 
-                logger.info(f"✅ Part {part} muvaffaqiyatli: {file_size} GB")
+                # Ingest bitrate ni yangilash
+                info['ingest_bps'] = update_bitrate(
+                    info.get('ingest_bps'), size_bytes, time.monotonic() - part_started
+                )
+                
+                logger.info(
+                    f"✅ Part {part} muvaffaqiyatli: {file_size} GB "
+                    f"({(info['ingest_bps'] or 0) / 1_000_000:.2f} Mbit/s, "
+                    f"{format_quality(info['part_quality'])})"
+                )
+                
+                # Tugagan partni darhol yuklash
+                if info['policy'].get('upload_parts', UPLOAD_PARTS_WHILE_RECORDING):
+                    part_uploads.append(asyncio.create_task(
+                        upload_completed_part(bot, recording_id, filename, upload_lock)
+                    ))
                 
                 # Muvaffaqiyat xabari
                 await start_msg.edit_text(
@@ -217,23 +865,81 @@ async def record_stream(
                     f"📺 {title or 'Nomaʼlum'}\n"
                     f"📁 {filename}\n"
                     f"💾 {file_size} GB\n"
+                    f"📉 {format_quality(info['part_quality'])}\n"
                     f"⏰ {datetime.now().strftime('%H:%M:%S')}\n"
-                    f"🎯 <i>Keyingi part boshlandi...</i>",
+                    + (
+                        "⏹️ <i>Yozuv to'xtatilmoqda...</i>" if info['stopping'] else
+                        "⏸ <i>Yozuv pauzada</i>" if info['paused'] else
+                        "🎯 <i>Keyingi part boshlandi...</i>"
+                    ),
                     parse_mode='HTML'
                 )
                 
                 part += 1
                 
+            elif info['stopping'] or info['paused']:
+                # Part hali ma'lumot yozmasdan yakunlandi
+                await run_fs(remove_file, output_path)
+                await start_msg.delete()
+                
+            elif can_step_down(info):
+                # Variant umuman yozilmadi - pastroq variant bilan qayta urinish
+                logger.warning(f"❌ Part {part} yozilmadi, pastroq variantga o'tish")
+                await run_fs(remove_file, output_path)
+                await start_msg.delete()
+                info['step_down'] = True
+                
             else:
                 logger.error(f"❌ Part {part} yozishda xato")
                 await start_msg.edit_text(
                     f"❌ <b>Part {part} yozishda xato!</b>\n\n"
                     f"📺 {title or 'Nomaʼlum'}\n"
                     f"🔗 URL ni tekshiring\n"
+                    f"🧾 <code>{html.escape(info.get('last_ffmpeg_line', '-'))}</code>\n"
                     f"⏰ {datetime.now().strftime('%H:%M:%S')}",
                     parse_mode='HTML'
                 )
                 break
+            
+            # Manba tanlangan variantni ko'tara olmasa - pastroq variantga o'tish
+            if info['step_down']:
+                info['step_down'] = False
+                variant = step_down_variant(info)
+                if variant:
+                    logger.info(f"📉 Variant pasaytirildi ({recording_id}): {variant['bandwidth']} bit/s")
+                    await bot.send_message(
+                        chat_id,
+                        f"📉 <b>Sifat pasaytirildi</b>\n\n"
+                        f"📺 {title or 'Nomaʼlum'}\n"
+                        f"🎚 {format_variant(info['variants'], info['variant_index'])}\n"
+                        f"📊 {format_quality(info['part_quality'])}",
+                        parse_mode='HTML'
+                    )
+            
+            # Pauza - sessiya saqlanadi, resume yoki stop kutiladi
+            if info['paused'] and not info['stopping']:
+                logger.info(f"⏸ Yozuv pauza qilindi: {recording_id}")
+                await bot.send_message(
+                    chat_id,
+                    f"⏸ <b>Yozuv pauzada</b>\n\n"
+                    f"📺 {title or 'Nomaʼlum'}\n"
+                    f"🆔 <code>{recording_id}</code>\n"
+                    f"▶️ <i>Davom ettirish uchun /resume</i>",
+                    parse_mode='HTML'
+                )
+                await info['resume_event'].wait()
+                if not info['stopping']:
+                    logger.info(f"▶️ Yozuv davom ettirildi: {recording_id}")
+        
+        if info['stopping']:
+            logger.info(f"⏹️ Yozuv to'xtatildi: {recording_id}")
+            await bot.send_message(
+                chat_id,
+                f"⏹️ <b>Yozuv to'xtatildi!</b>\n\n"
+                f"📺 {title or 'Nomaʼlum'}\n"
+                f"🆔 <code>{recording_id}</code>",
+                parse_mode='HTML'
+            )
                 
     except asyncio.CancelledError:
         logger.info(f"⏹️ Yozuv to'xtatildi: {recording_id}")
@@ -251,7 +957,14 @@ async def record_stream(
         )
     
     finally:
-        # Yuklashni boshlash
+        # Bekor qilinganda ffmpeg ni yetim qoldirmaslik
+        terminate_part(info)
+        
+        # Davom etayotgan part yuklashlarini kutish
+        if part_uploads:
+            await asyncio.gather(*part_uploads, return_exceptions=True)
+        
+        # Qolgan fayllarni yuklash
         if recording_id in recorded_files and recorded_files[recording_id]:
             total_files = len(recorded_files[recording_id])
             session_duration = format_duration(int((datetime.now() - session_start).total_seconds()))
@@ -274,12 +987,56 @@ async def record_stream(
         if recording_id in active_recordings:
             del active_recordings[recording_id]
 
+async def upload_file(bot: Bot, file_path: Path, size_bytes: int):
+    """Bitta faylni kanalga yuklash, tezlikni o'lchash va faylni o'chirish"""
+    file_size = round(size_bytes / (1024 ** 3), 2)
+    
+    video = FSInputFile(file_path)
+    async with upload_semaphore:
+        started = time.monotonic()
+        await bot.send_video(
+            chat_id=CHANNEL_ID,
+            video=video,
+            caption=f"📹 {file_path.name}\n💾 {file_size} GB\n⏰ {datetime.now().strftime('%Y-%m-%d %H:%M')}",
+            supports_streaming=True
+        )
+    
+    # Yuklash tezligini yangilash (part bo'lish siyosati uchun)
+    upload_bps = update_bitrate(upload_stats['bps'], size_bytes, time.monotonic() - started)
+    if upload_bps:
+        upload_stats['bps'] = upload_bps
+    
+    logger.info(f"✅ Yuklandi: {file_path.name}")
+    
+    # Faylni o'chirish (xotirani tejash)
+    await run_fs(remove_file, file_path)
+
+async def upload_completed_part(bot: Bot, recording_id: str, filename: str, lock: asyncio.Lock):
+    """Tugagan partni yozuv davom etayotganda kanalga yuklash"""
+    async with lock:
+        file_path = OUTPUT_DIR / filename
+        size_bytes = await run_fs(get_file_size_bytes, file_path)
+        if size_bytes <= 0:
+            return
+        
+        try:
+            logger.info(f"⬆️ Part yuklanmoqda: {filename}")
+            await upload_file(bot, file_path, size_bytes)
+        except Exception as e:
+            # Fayl ro'yxatda qoladi va yozuv tugaganda qayta yuklanadi
+            logger.error(f"❌ Part yuklash xatosi ({filename}): {e}")
+            return
+        
+        pending = recorded_files.get(recording_id, [])
+        if filename in pending:
+            pending.remove(filename)
+
 async def auto_upload_recorded_files(bot: Bot, recording_id: str, chat_id: int):
     """Fayllarni avtomatik yuklash"""
     if recording_id not in recorded_files:
         return
     
-    files = recorded_files[recording_id]
+    files = list(recorded_files[recording_id])
     total_files = len(files)
     
     logger.info(f"📤 Yuklash: {total_files} ta fayl")
@@ -298,10 +1055,11 @@ async def auto_upload_recorded_files(bot: Bot, recording_id: str, chat_id: int):
     
     for i, filename in enumerate(files, 1):
         file_path = OUTPUT_DIR / filename
+        size_bytes = await run_fs(get_file_size_bytes, file_path)
         
-        if file_path.exists():
+        if size_bytes > 0:
             try:
-                file_size = get_file_size_gb(file_path)
+                file_size = round(size_bytes / (1024 ** 3), 2)
                 logger.info(f"⬆️ Yuklanmoqda: {filename} ({file_size} GB)")
                 
                 # Progress yangilash
@@ -315,19 +1073,9 @@ async def auto_upload_recorded_files(bot: Bot, recording_id: str, chat_id: int):
                 )
                 
                 # Yuklash
-                video = FSInputFile(file_path)
-                await bot.send_video(
-                    chat_id=CHANNEL_ID,
-                    video=video,
-                    caption=f"📹 {filename}\n💾 {file_size} GB\n⏰ {datetime.now().strftime('%Y-%m-%d %H:%M')}",
-                    supports_streaming=True
-                )
-                
+                await upload_file(bot, file_path, size_bytes)
                 uploaded_count += 1
-                logger.info(f"✅ Yuklandi: {filename}")
-                
-                # Faylni o'chirish (xotirani tejash)
-                file_path.unlink()
+                recorded_files[recording_id].remove(filename)
                 
             except Exception as e:
                 failed_count += 1
@@ -351,6 +1099,203 @@ async def auto_upload_recorded_files(bot: Bot, recording_id: str, chat_id: int):
     
     logger.info(f"🎉 Yuklash tugadi: {uploaded_count}/{total_files}")
 
+# ============================================
+# 🎛 YOZUVLARNI BOSHQARISH
+# ============================================
+
+CONTROL_ACTIONS = {
+    'stop': "⏹",
+    'pause': "⏸",
+    'resume': "▶️",
+    'policy': "✂️",
+}
+
+def terminate_part(info: dict, process=None):
+    """Joriy part ffmpeg process ini yakunlash (ffmpeg faylni to'g'ri yopadi)"""
+    current = info.get('process')
+    if current is None or (process is not None and current is not process):
+        return
+    if current.returncode is None:
+        current.terminate()
+
+def request_stop(recording_id: str) -> bool:
+    """Yozuvni to'xtatish - joriy part yopiladi va yuklanadi"""
+    info = active_recordings.get(recording_id)
+    if not info or info['stopping']:
+        return False
+    
+    info['stopping'] = True
+    info['paused'] = False
+    info['resume_event'].set()
+    terminate_part(info)
+    logger.info(f"⏹️ Yozuvni to'xtatish so'raldi: {info['title']}")
+    return True
+
+def pause_recording(recording_id: str) -> bool:
+    """Yozuvni pauza qilish - sessiya va yozilgan partlar saqlanadi"""
+    info = active_recordings.get(recording_id)
+    if not info or info['stopping'] or info['paused']:
+        return False
+    
+    info['paused'] = True
+    info['resume_event'].clear()
+    terminate_part(info)
+    return True
+
+def resume_recording(recording_id: str) -> bool:
+    """Pauzadagi yozuvni davom ettirish"""
+    info = active_recordings.get(recording_id)
+    if not info or info['stopping'] or not info['paused']:
+        return False
+    
+    info['paused'] = False
+    info['resume_event'].set()
+    return True
+
+def rebind_policy(recording_id: str, policy: dict) -> Optional[dict]:
+    """
+    Ishlayotgan yozuv siyosatini almashtirish. Keyingi partlar yangi siyosat
+    bilan rejalashtiriladi; joriy part yangi rejadan uzunroq bo'lsa, u
+    muddatidan oldin kesiladi. Yangi rejani qaytaradi.
+    """
+    info = active_recordings.get(recording_id)
+    if not info or info['stopping']:
+        return None
+    
+    plan = plan_next_part(policy, info.get('ingest_bps'))
+    info['policy'] = policy
+    
+    process = info.get('process')
+    if process is None or process.returncode is not None:
+        return plan
+    
+    elapsed = time.monotonic() - info['part_started']
+    remaining = plan['duration_sec'] - elapsed
+    current_remaining = info['part_plan']['duration_sec'] - elapsed
+    
+    if info.get('cut_handle'):
+        info['cut_handle'].cancel()
+        info['cut_handle'] = None
+    
+    if remaining <= 0:
+        terminate_part(info)
+    elif remaining < current_remaining:
+        loop = asyncio.get_running_loop()
+        info['cut_handle'] = loop.call_later(remaining, terminate_part, info, process)
+    
+    return plan
+
+async def stop_recordings_staggered(recording_ids: List[str]):
+    """Bir nechta yozuvni navbat bilan to'xtatish (yuklashlar bir vaqtda boshlanmasligi uchun)"""
+    stopped_any = False
+    for rec_id in recording_ids:
+        # Faqat haqiqatda to'xtatilgan yozuvdan keyin kutish
+        if stopped_any and rec_id in active_recordings and not active_recordings[rec_id]['stopping']:
+            await asyncio.sleep(STOP_STAGGER_SEC)
+        if request_stop(rec_id):
+            stopped_any = True
+
+def control_targets(action: str) -> List[str]:
+    """Amal qo'llanishi mumkin bo'lgan yozuvlar"""
+    targets = []
+    for rec_id, info in active_recordings.items():
+        if info['stopping']:
+            continue
+        if action == 'pause' and info['paused']:
+            continue
+        if action == 'resume' and not info['paused']:
+            continue
+        targets.append(rec_id)
+    return targets
+
+def recordings_keyboard(action: str) -> Optional[InlineKeyboardMarkup]:
+    """active_recordings dan amal tugmalarini yaratish"""
+    targets = control_targets(action)
+    if not targets:
+        return None
+    
+    rows = [
+        [InlineKeyboardButton(
+            text=f"{CONTROL_ACTIONS[action]} {active_recordings[rec_id]['title'][:25]} ({rec_id})",
+            callback_data=f"{action}:{rec_id}"
+        )]
+        for rec_id in targets
+    ]
+    if action == 'stop' and len(targets) > 1:
+        rows.append([InlineKeyboardButton(text="⏹ Hammasini to'xtatish", callback_data="stop:all")])
+    
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def apply_control_action(action: str, target: str) -> str:
+    """Amalni bajarish va foydalanuvchiga javob matnini qaytarish"""
+    if action == 'stop' and target == 'all':
+        targets = control_targets('stop')
+        if not targets:
+            return "❌ To'xtatish uchun faol yozuv yo'q."
+        task = asyncio.create_task(stop_recordings_staggered(targets))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+        return (
+            f"⏹️ <b>{len(targets)} ta yozuv to'xtatilmoqda:</b>\n\n" +
+            "\n".join(f"• {active_recordings[rec_id]['title']}" for rec_id in targets) +
+            f"\n\n📦 <i>Har {STOP_STAGGER_SEC:g} soniyada bittadan yakunlanadi va yuklanadi...</i>"
+        )
+    
+    info = active_recordings.get(target)
+    if not info:
+        return f"❌ <code>{html.escape(target)}</code> ID li faol yozuv topilmadi."
+    
+    if action == 'stop' and request_stop(target):
+        return f"⏹️ <b>{info['title']}</b> to'xtatilmoqda...\n\n📦 <i>Joriy part yopiladi va yuklanadi.</i>"
+    if action == 'pause' and pause_recording(target):
+        return f"⏸ <b>{info['title']}</b> pauza qilinmoqda...\n\n<i>Joriy part yopiladi va yuklanadi.</i>"
+    if action == 'resume' and resume_recording(target):
+        return f"▶️ <b>{info['title']}</b> davom ettirildi."
+    
+    return f"⚠️ <b>{info['title']}</b> uchun bu amalni hozir bajarib bo'lmaydi."
+
+# ============================================
+# 📈 EVENT LOOP MONITORING
+# ============================================
+
+async def monitor_loop_lag(bot: Bot):
+    """
+    Event loop bloklanishini kuzatish - uyqu kutilganidan qancha
+    kech tugaganini o'lchaydi va chegaradan oshsa adminni ogohlantiradi
+    """
+    loop = asyncio.get_running_loop()
+    last_alert = -math.inf
+    
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - started - LOOP_LAG_INTERVAL)
+        
+        loop_lag_stats['last'] = lag
+        loop_lag_stats['max'] = max(loop_lag_stats['max'], lag)
+        
+        if lag <= LOOP_LAG_THRESHOLD:
+            continue
+        
+        logger.warning(f"🐢 Event loop {lag * 1000:.0f} ms bloklandi")
+        
+        now = loop.time()
+        if now - last_alert < LOOP_LAG_ALERT_COOLDOWN:
+            continue
+        last_alert = now
+        
+        try:
+            await bot.send_message(
+                ADMIN_ID,
+                f"🐢 <b>Event loop bloklandi!</b>\n\n"
+                f"⏱ Kechikish: {lag * 1000:.0f} ms\n"
+                f"📏 Chegara: {LOOP_LAG_THRESHOLD * 1000:.0f} ms\n"
+                f"⏰ {datetime.now().strftime('%H:%M:%S')}",
+                parse_mode='HTML'
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Loop kechikishi haqida xabar yuborilmadi: {e}")
+
 # ============================================
 # 🤖 BOT HANDLERS
 # ============================================
@@ -375,6 +1320,8 @@ async def cmd_start(message: types.Message):
         "/record - Stream yozishni boshlash\n"
         "/status - Joriy holat\n"
         "/stop - Yozuvni to'xtatish\n"
+        "/pause, /resume - Pauza / davom ettirish\n"
+        "/policy - Part siyosatini o'zgartirish\n"
         "/list - Yozilgan fayllar\n"
         "/info - Tizim ma'lumotlari\n"
         "/help - Yordam\n\n"
@@ -398,7 +1345,12 @@ async def cmd_record(message: types.Message, state: FSMContext):
             "📡 <b>Stream havolasini yuboring:</b>\n\n"
             "Misol uchun:\n"
             "<code>/record https://example.com/stream.m3u8</code>\n"
-            "<code>/record http://livestream.com/channel</code>\n\n"
+            "<code>/record http://livestream.com/channel</code>\n"
+            "<code>/record URL size=1.5 duration=30 upload=10</code>\n\n"
+            "⚙️ <b>Part parametrlari (ixtiyoriy):</b>\n"
+            "• <code>size</code> - max hajm, GB\n"
+            "• <code>duration</code> - max davomiylik, daqiqa\n"
+            "• <code>upload</code> - maqsadli yuklash vaqti, daqiqa (0 - o'chirish)\n\n"
             "Yoki oddiygina <code>/record</code> deb yozing va "
             "havolani keyin yuboring.",
             parse_mode='HTML'
@@ -406,22 +1358,40 @@ async def cmd_record(message: types.Message, state: FSMContext):
         await state.set_state(RecordState.waiting_for_link)
         return
     
-    url = args[1].strip()
-    await process_record_request(message, state, url)
+    await process_record_request(message, state, args[1])
 
-async def process_record_request(message: types.Message, state: FSMContext, url: str):
+async def process_record_request(message: types.Message, state: FSMContext, text: str):
     """Yozuv so'rovini qayta ishlash"""
+    try:
+        url, policy = parse_record_args(text)
+    except ValueError as e:
+        await message.answer(f"❌ <b>Noto'g'ri parametr:</b> {e}", parse_mode='HTML')
+        return
+    
     logger.info(f"🔗 URL qabul qilindi: {url[:50]}...")
     
     # Stream ma'lumotlarini olish
     await message.answer("🔍 <b>Stream ma'lumotlarini tekshirmoqda...</b>", parse_mode='HTML')
     
-    title = get_stream_title(url)
+    title, bitrate = await get_stream_info(url)
     if not title:
         title = f"Stream_{datetime.now().strftime('%H%M%S')}"
         logger.info(f"📺 Sarlavha topilmadi, standart ishlatiladi: {title}")
     
-    await state.update_data(url=url, title=title)
+    # HLS master playlist bo'lsa byudjetga mos variantni tanlash
+    variants = await fetch_hls_variants(url)
+    variant_index = None
+    if variants:
+        budget = await stream_budget_bps()
+        variant_index = select_variant(variants, budget)
+        bitrate = variants[variant_index]['bandwidth']
+        logger.info(f"🎚 Variant tanlandi: {format_variant(variants, variant_index)}, byudjet: {budget}")
+    
+    await state.update_data(
+        url=url, title=title, policy=policy, bitrate=bitrate,
+        variants=variants, variant_index=variant_index
+    )
+    plan = plan_next_part(policy, bitrate)
     
     # Tasdiqlash klaviaturasi
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -435,10 +1405,14 @@ async def process_record_request(message: types.Message, state: FSMContext, url:
         f"📡 <b>Stream yozishni boshlaymi?</b>\n\n"
         f"🎬 <b>Nomi:</b> {title}\n"
         f"🔗 <b>URL:</b> <code>{url[:60]}...</code>\n"
-        f"💾 <b>Max hajm:</b> {MAX_FILE_SIZE_GB} GB\n"
+        f"✂️ <b>Part siyosati:</b> {format_split_policy(policy)}\n"
+        f"📶 <b>Bitrate:</b> {f'{bitrate / 1_000_000:.2f} Mbit/s' if bitrate else 'nomaʼlum'}\n"
+        + (f"🎚 <b>Variant:</b> {format_variant(variants, variant_index)}\n" if variants else "")
+        + f"⏱ <b>Birinchi part:</b> ~{format_duration(plan['duration_sec'])}\n"
         f"📍 <b>Platforma:</b> Railway.app\n\n"
-        f"<i>Yozuv boshlangandan so'ng, har bir {MAX_FILE_SIZE_GB} GB dan "
-        f"keyin yangi fayl yaratiladi va kanalga avtomatik yuklanadi.</i>",
+        f"<i>Yozuv boshlangandan so'ng, part hajm, davomiylik yoki yuklash "
+        f"vaqti chegarasiga yetganda yangi fayl yaratiladi va kanalga "
+        f"avtomatik yuklanadi.</i>",
         parse_mode='HTML',
         reply_markup=keyboard
     )
@@ -450,8 +1424,7 @@ async def handle_url_message(message: types.Message, state: FSMContext):
     if not check_admin(message.from_user.id):
         return
     
-    url = message.text.strip()
-    await process_record_request(message, state, url)
+    await process_record_request(message, state, message.text)
 
 async def handle_confirm_record(callback: types.CallbackQuery, state: FSMContext):
     """Yozuvni tasdiqlash"""
@@ -460,6 +1433,7 @@ async def handle_confirm_record(callback: types.CallbackQuery, state: FSMContext
     data = await state.get_data()
     url = data.get('url')
     title = data.get('title')
+    policy = data.get('policy') or default_split_policy()
     
     # Recording ID yaratish
     recording_id = str(uuid.uuid4())[:8]
@@ -476,13 +1450,25 @@ async def handle_confirm_record(callback: types.CallbackQuery, state: FSMContext
         'url': url,
         'title': title,
         'started': datetime.now(),
-        'chat_id': callback.message.chat.id
+        'chat_id': callback.message.chat.id,
+        'policy': policy,
+        'ingest_bps': data.get('bitrate'),
+        'process': None,
+        'paused': False,
+        'stopping': False,
+        'resume_event': asyncio.Event(),
+        'variants': data.get('variants') or [],
+        'variant_index': data.get('variant_index') or 0,
+        'quality': new_quality_counters(),
+        'part_quality': new_quality_counters(),
+        'step_down': False
     }
     
     await callback.message.edit_text(
         f"✅ <b>Yozuv boshlandi!</b>\n\n"
         f"🎬 <b>Stream:</b> {title}\n"
         f"🆔 <b>ID:</b> <code>{recording_id}</code>\n"
+        f"✂️ <b>Part siyosati:</b> {format_split_policy(policy)}\n"
         f"⏰ <b>Boshlangan:</b> {datetime.now().strftime('%H:%M:%S')}\n"
         f"📍 <b>Platforma:</b> Railway.app\n\n"
         f"<i>Yozuv davom etmoqda... /status bilan holatni tekshiring.</i>",
@@ -521,19 +1507,40 @@ async def cmd_status(message: types.Message):
         duration = datetime.now() - info['started']
         duration_str = format_duration(int(duration.total_seconds()))
         
+        if info['stopping']:
+            state_icon = "⏹"
+        elif info['paused']:
+            state_icon = "⏸"
+        else:
+            state_icon = "🔴"
+        
         status_text += (
-            f"🔴 <b>{info['title']}</b>\n"
+            f"{state_icon} <b>{info['title']}</b>\n"
             f"   🆔 <code>{rec_id}</code>\n"
             f"   ⏰ {duration_str}\n"
+            f"   ✂️ {format_split_policy(info['policy'])}\n"
+            + (f"   🎚 {format_variant(info['variants'], info['variant_index'])}\n" if info['variants'] else "")
+            + f"   📉 {format_quality(info['quality'])}\n"
             f"   📍 {info['url'][:40]}...\n\n"
         )
     
-    status_text += f"<i>Jami: {len(active_recordings)} ta faol yozuv</i>"
+    status_text += (
+        f"<i>Jami: {len(active_recordings)} ta faol yozuv</i>\n"
+        f"<i>Boshqarish: /stop, /pause, /resume, /policy</i>"
+    )
     
     await message.answer(status_text, parse_mode='HTML')
 
+async def send_control_prompt(message: types.Message, action: str, prompt: str):
+    """Yozuvni tanlash uchun inline klaviatura yuborish"""
+    keyboard = recordings_keyboard(action)
+    if keyboard is None:
+        await message.answer("❌ Bu amal uchun mos faol yozuv yo'q.")
+        return
+    await message.answer(prompt, parse_mode='HTML', reply_markup=keyboard)
+
 async def cmd_stop(message: types.Message):
-    """Stop komandasi"""
+    """Stop komandasi: /stop, /stop <id> yoki /stop all"""
     if not check_admin(message.from_user.id):
         return
     
@@ -541,30 +1548,116 @@ async def cmd_stop(message: types.Message):
         await message.answer("❌ To'xtatish uchun faol yozuv yo'q.")
         return
     
-    stopped_count = 0
-    stopped_list = []
+    args = message.text.split()
+    if len(args) > 1:
+        await message.answer(apply_control_action('stop', args[1]), parse_mode='HTML')
+        return
     
-    for rec_id in list(active_recordings.keys()):
-        info = active_recordings[rec_id]
-        info['task'].cancel()
-        stopped_list.append(info['title'])
-        stopped_count += 1
-        
-        logger.info(f"⏹️ Yozuv to'xtatildi: {info['title']}")
+    await send_control_prompt(message, 'stop', "⏹ <b>Qaysi yozuvni to'xtatish kerak?</b>")
+
+async def cmd_pause(message: types.Message):
+    """Pause komandasi: /pause yoki /pause <id>"""
+    if not check_admin(message.from_user.id):
+        return
+    
+    args = message.text.split()
+    if len(args) > 1:
+        await message.answer(apply_control_action('pause', args[1]), parse_mode='HTML')
+        return
+    
+    await send_control_prompt(message, 'pause', "⏸ <b>Qaysi yozuvni pauza qilish kerak?</b>")
+
+async def cmd_resume(message: types.Message):
+    """Resume komandasi: /resume yoki /resume <id>"""
+    if not check_admin(message.from_user.id):
+        return
+    
+    args = message.text.split()
+    if len(args) > 1:
+        await message.answer(apply_control_action('resume', args[1]), parse_mode='HTML')
+        return
+    
+    await send_control_prompt(message, 'resume', "▶️ <b>Qaysi yozuvni davom ettirish kerak?</b>")
+
+async def cmd_policy(message: types.Message, state: FSMContext):
+    """Policy komandasi: /policy yoki /policy <id> size=.. duration=.. upload=.. live=.."""
+    if not check_admin(message.from_user.id):
+        return
+    
+    args = message.text.split(maxsplit=2)
+    if len(args) > 1:
+        await apply_policy_change(message, args[1], args[2] if len(args) > 2 else "")
+        return
+    
+    await send_control_prompt(message, 'policy', "✂️ <b>Qaysi yozuv siyosatini o'zgartirish kerak?</b>")
+
+async def apply_policy_change(message: types.Message, recording_id: str, text: str):
+    """Ishlayotgan yozuvga yangi siyosatni qo'llash"""
+    info = active_recordings.get(recording_id)
+    if not info or info['stopping']:
+        await message.answer(f"❌ <code>{html.escape(recording_id)}</code> ID li faol yozuv topilmadi.", parse_mode='HTML')
+        return
+    
+    try:
+        policy = parse_split_policy(text.split(), base=info['policy'])
+    except ValueError as e:
+        await message.answer(f"❌ <b>Noto'g'ri parametr:</b> {e}", parse_mode='HTML')
+        return
+    
+    plan = rebind_policy(recording_id, policy)
+    logger.info(f"✂️ Siyosat yangilandi ({recording_id}): {format_split_policy(policy)}")
     
     await message.answer(
-        f"⏹️ <b>{stopped_count} ta yozuv to'xtatildi:</b>\n\n" +
-        "\n".join(f"• {title}" for title in stopped_list) +
-        f"\n\n📦 <i>Yuklash jarayoni boshlandi...</i>",
+        f"✂️ <b>Siyosat yangilandi!</b>\n\n"
+        f"📺 {info['title']}\n"
+        f"⚙️ {format_split_policy(policy)}\n"
+        f"⏱ Keyingi part: ~{format_duration(plan['duration_sec'])}",
         parse_mode='HTML'
     )
 
+async def handle_control_callback(callback: types.CallbackQuery, state: FSMContext):
+    """Inline klaviatura orqali boshqarish"""
+    if not check_admin(callback.from_user.id):
+        await callback.answer("🚫 Ruxsat yo'q")
+        return
+    
+    action, _, target = callback.data.partition(':')
+    
+    if action == 'policy':
+        info = active_recordings.get(target)
+        if not info:
+            await callback.message.edit_text(f"❌ <code>{html.escape(target)}</code> ID li faol yozuv topilmadi.", parse_mode='HTML')
+            return
+        await state.update_data(recording_id=target)
+        await state.set_state(ControlState.waiting_for_policy)
+        await callback.message.edit_text(
+            f"✂️ <b>{info['title']}</b>\n\n"
+            f"⚙️ Joriy: {format_split_policy(info['policy'])}\n\n"
+            f"Yangi parametrlarni yuboring, masalan:\n"
+            f"<code>size=1.5 duration=30 upload=10 live=1</code>",
+            parse_mode='HTML'
+        )
+        await callback.answer()
+        return
+    
+    await callback.message.edit_text(apply_control_action(action, target), parse_mode='HTML')
+    await callback.answer()
+
+async def handle_policy_message(message: types.Message, state: FSMContext):
+    """Siyosat parametrlarini qabul qilish"""
+    if not check_admin(message.from_user.id):
+        return
+    
+    data = await state.get_data()
+    await state.clear()
+    await apply_policy_change(message, data.get('recording_id', ''), message.text)
+
 async def cmd_list(message: types.Message):
     """Fayllar ro'yxati"""
     if not check_admin(message.from_user.id):
         return
     
-    files = list(OUTPUT_DIR.glob("*.mp4"))
+    files = await run_fs(list_recorded_files)
     
     if not files:
         await message.answer(
@@ -574,14 +1667,10 @@ async def cmd_list(message: types.Message):
         )
         return
     
-    # Fayllarni sana bo'yicha tartiblash
-    files.sort(key=lambda x: x.stat().st_mtime, reverse=True)
-    
     files_text = f"📁 <b>Yozilgan Fayllar:</b> ({len(files)} ta)\n\n"
     
-    for i, file in enumerate(files[:10], 1):  # Faqat 10 ta ko'rsatish
-        size = get_file_size_gb(file)
-        mtime = datetime.fromtimestamp(file.stat().st_mtime)
+    for i, (file, size, mtime) in enumerate(files[:10], 1):  # Faqat 10 ta ko'rsatish
+        mtime = datetime.fromtimestamp(mtime)
         time_str = mtime.strftime('%Y-%m-%d %H:%M')
         
         files_text += f"{i}. <code>{file.name}</code>\n"
@@ -599,10 +1688,7 @@ async def cmd_info(message: types.Message):
     
     # Disk hajmini tekshirish
     try:
-        disk_info = os.statvfs('/tmp')
-        free_gb = (disk_info.f_bavail * disk_info.f_frsize) / (1024 ** 3)
-        total_gb = (disk_info.f_blocks * disk_info.f_frsize) / (1024 ** 3)
-        used_gb = total_gb - free_gb
+        total_gb, used_gb, free_gb = await run_fs(get_disk_usage)
     except:
         free_gb = total_gb = used_gb = 0
     
@@ -617,7 +1703,9 @@ async def cmd_info(message: types.Message):
         f"   • Foydalanilgan: {used_gb:.1f} GB\n"
         f"   • Bo'sh: {free_gb:.1f} GB\n\n"
         f"🎬 <b>Faol Yozuvlar:</b> {len(active_recordings)} ta\n"
-        f"📁 <b>Yozilgan Fayllar:</b> {sum(len(f) for f in recorded_files.values())} ta\n\n"
+        f"📁 <b>Yozilgan Fayllar:</b> {sum(len(f) for f in recorded_files.values())} ta\n"
+        f"⏱ <b>Loop kechikishi:</b> {loop_lag_stats['last'] * 1000:.0f} ms "
+        f"(max {loop_lag_stats['max'] * 1000:.0f} ms)\n\n"
         f"<i>Bot doimiy ishlaydi va avtomatik restart qilinadi.</i>"
     )
     
@@ -629,15 +1717,20 @@ async def cmd_help(message: types.Message):
         "🆘 <b>Yordam - IPTV Recorder Bot</b>\n\n"
         "📋 <b>Buyruqlar Ro'yxati:</b>\n"
         "• /start - Botni ishga tushirish\n"
-        "• /record [url] - Stream yozishni boshlash\n"
+        "• /record [url] [size=GB] [duration=daq] [upload=daq] - Stream yozishni boshlash\n"
         "• /status - Joriy yozuvlarni ko'rish\n"
-        "• /stop - Barcha yozuvlarni to'xtatish\n"
+        "• /stop [id|all] - Yozuvni to'xtatish\n"
+        "• /pause [id] - Yozuvni pauza qilish\n"
+        "• /resume [id] - Yozuvni davom ettirish\n"
+        "• /policy [id] [size=..] [duration=..] [upload=..] [live=0|1] - Siyosatni o'zgartirish\n"
         "• /list - Yozilgan fayllar ro'yxati\n"
         "• /info - Tizim ma'lumotlari\n"
         "• /help - Ushbu yordam xabari\n\n"
         "⚡ <b>Qo'shimcha Ma'lumot:</b>\n"
         "• Bot 24/7 ishlaydi\n"
-        "• Har 1.8 GB dan keyin yangi fayl\n"
+        f"• Har {MAX_FILE_SIZE_GB} GB yoki {MAX_PART_DURATION_MIN:g} daqiqadan keyin yangi fayl\n"
+        "• Part uzunligi bitrate va yuklash tezligiga moslashadi\n"
+        "• HLS da mos sifat tanlanadi, xatolarda pasaytiriladi\n"
         "• Avtomatik kanalga yuklash\n"
         "• Xatolarda avtomatik qayta urinish\n\n"
         "🔧 <b>Platforma:</b> Railway.app",
@@ -665,6 +1758,10 @@ async def main():
         print("="*50 + "\n")
         return
     
+    # Yuklashlar cheklovi (event loop ichida yaratiladi)
+    global upload_semaphore
+    upload_semaphore = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+    
     # Bot yaratish
     bot = Bot(token=BOT_TOKEN)
     storage = MemoryStorage()
@@ -675,6 +1772,9 @@ async def main():
     dp.message.register(cmd_record, Command("record"))
     dp.message.register(cmd_status, Command("status"))
     dp.message.register(cmd_stop, Command("stop"))
+    dp.message.register(cmd_pause, Command("pause"))
+    dp.message.register(cmd_resume, Command("resume"))
+    dp.message.register(cmd_policy, Command("policy"))
     dp.message.register(cmd_list, Command("list"))
     dp.message.register(cmd_info, Command("info"))
     dp.message.register(cmd_help, Command("help"))
@@ -682,13 +1782,18 @@ async def main():
     
     # State handlerlari
     dp.message.register(handle_url_message, RecordState.waiting_for_link)
+    dp.message.register(handle_policy_message, ControlState.waiting_for_policy)
     
     # Callback handlerlari
     dp.callback_query.register(handle_confirm_record, F.data == "confirm_record")
     dp.callback_query.register(handle_cancel_record, F.data == "cancel_record")
+    dp.callback_query.register(handle_control_callback, F.data.regexp(r"^(stop|pause|resume|policy):"))
     
     logger.info("✅ Barcha handlerlar ro'yxatdan o'tkazildi")
     
+    # Event loop monitoringini boshlash
+    lag_monitor = asyncio.create_task(monitor_loop_lag(bot))
+    
     try:
         # Bot ma'lumotlarini olish
         bot_info = await bot.get_me()
@@ -716,8 +1821,11 @@ async def main():
     
     finally:
         logger.info("🛑 Bot to'xtatilmoqda...")
+        lag_monitor.cancel()
         await bot.session.close()
+        fs_executor.shutdown(wait=False)
         logger.info("✅ Bot to'xtatildi")
+        log_listener.stop()
 
 # ============================================
 # 🎯 DOCKER VA RAILWAY ISHGA TUSHIRISH
@@ -0,0 +1,461 @@
+import asyncio
+import threading
+import time
+import types
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+import bot
+
+
+@pytest.fixture(autouse=True)
+def fixed_upload_speed(monkeypatch):
+    monkeypatch.setitem(bot.upload_stats, 'bps', 20_000_000)
+    monkeypatch.setattr(bot, 'active_recordings', {})
+
+
+def test_parse_split_policy_defaults():
+    assert bot.parse_split_policy([]) == bot.default_split_policy()
+
+
+def test_parse_split_policy_options():
+    policy = bot.parse_split_policy(["size=1", "duration=30", "upload=0", "live=0"])
+    assert policy['max_size_gb'] == 1
+    assert policy['max_duration_min'] == 30
+    assert policy['target_upload_min'] == 0
+    assert policy['upload_parts'] is False
+
+
+def test_parse_split_policy_keeps_base():
+    base = bot.parse_split_policy(["size=1"])
+    policy = bot.parse_split_policy(["duration=5"], base=base)
+    assert policy['max_size_gb'] == 1
+    assert policy['max_duration_min'] == 5
+    assert base['max_duration_min'] == bot.MAX_PART_DURATION_MIN
+
+
+@pytest.mark.parametrize("option", [
+    "duration=inf", "size=nan", "upload=-inf", "size=-1", "duration=0",
+    "size=1e-9", "duration=0.1", "upload=0.001", "size=100", "foo=1",
+    "size", "size=abc",
+])
+def test_parse_split_policy_rejects(option):
+    with pytest.raises(ValueError):
+        bot.parse_split_policy([option])
+
+
+def test_parse_record_args():
+    url, policy = bot.parse_record_args("http://x/a.m3u8 size=1.5")
+    assert url == "http://x/a.m3u8"
+    assert policy['max_size_gb'] == 1.5
+    with pytest.raises(ValueError):
+        bot.parse_record_args("   ")
+
+
+def test_plan_next_part_unknown_bitrate_uses_duration():
+    policy = bot.parse_split_policy(["upload=0"])
+    plan = bot.plan_next_part(policy, None)
+    assert plan['duration_sec'] == policy['max_duration_min'] * 60
+    assert plan['size_bytes'] == int(policy['max_size_gb'] * 1024 ** 3)
+    assert plan['reason'] == 'davomiylik'
+
+
+def test_plan_next_part_unknown_bitrate_keeps_upload_reason():
+    policy = bot.parse_split_policy(["upload=1"])
+    plan = bot.plan_next_part(policy, None)
+    assert plan['size_bytes'] == int(20_000_000 / 8 * 60)
+    assert plan['reason'] == 'yuklash vaqti'
+
+
+def test_plan_next_part_low_bitrate_capped_by_duration():
+    policy = bot.parse_split_policy(["duration=30", "upload=0"])
+    plan = bot.plan_next_part(policy, 128_000)
+    assert plan['duration_sec'] == 30 * 60
+    assert plan['reason'] == 'davomiylik'
+
+
+def test_plan_next_part_high_bitrate_predicts_cut():
+    policy = bot.parse_split_policy(["size=1", "upload=0"])
+    plan = bot.plan_next_part(policy, 40_000_000)
+    expected = 1024 ** 3 * 8 / 40_000_000 * bot.SPLIT_SAFETY_MARGIN
+    assert plan['duration_sec'] == int(expected)
+    assert plan['reason'] == 'hajm'
+
+
+def test_plan_next_part_minimum_duration():
+    policy = bot.parse_split_policy(["size=0.05", "upload=0"])
+    plan = bot.plan_next_part(policy, 1_000_000_000)
+    assert plan['duration_sec'] == bot.MIN_PART_DURATION_SEC
+
+
+def test_plan_next_part_shares_upload_between_recordings(monkeypatch):
+    policy = bot.parse_split_policy(["upload=5"])
+    single = bot.plan_next_part(policy, None)
+    monkeypatch.setattr(bot, 'active_recordings', {
+        'a': {'policy': policy, 'stopping': False},
+        'b': {'policy': policy, 'stopping': False},
+        'c': {'policy': bot.parse_split_policy(["live=0"]), 'stopping': False},
+        'd': {'policy': policy, 'stopping': True},
+    })
+    shared = bot.plan_next_part(policy, None)
+    assert shared['size_bytes'] == single['size_bytes'] // 2
+
+
+@pytest.mark.parametrize("line, kind", [
+    ("[hls @ 0x55] Failed to open segment 1842 of playlist 0", 'segment_errors'),
+    ("[hls @ 0x55] Segment 12 of playlist 0 failed too many times, skipping", 'segment_errors'),
+    ("[https @ 0x55] HTTP error 404 Not Found", 'segment_errors'),
+    ("[mp4 @ 0x55] Non-monotonous DTS in output stream 0:1; previous: 10, current: 5; "
+     "changing to 11. This may result in incorrect timestamps in the output file.", 'dts_warnings'),
+    ("[mp4 @ 0x55] Application provided invalid, non monotonically increasing dts to muxer "
+     "in stream 0: 100 >= 90", 'dts_warnings'),
+    ("[mpegts @ 0x55] Packet corrupt (stream = 0, dts = 8100000).", None),
+    ("[hls @ 0x55] Skipping unsupported attribute", None),
+    ("Opening 'https://cdn/seg1.ts' for reading", None),
+])
+def test_classify_ffmpeg_line(line, kind):
+    assert bot.classify_ffmpeg_line(line) == kind
+
+
+MEDIA_PLAYLIST = """#EXTM3U
+#EXT-X-TARGETDURATION:6
+#EXT-X-MEDIA-SEQUENCE:100
+#EXTINF:6.0,
+seg100.ts
+#EXT-X-DISCONTINUITY
+#EXTINF:6.0,
+seg101.ts
+#EXTINF:6.0,
+seg102.ts
+"""
+
+
+def test_count_new_discontinuities_first_read_sets_baseline():
+    assert bot.count_new_discontinuities(MEDIA_PLAYLIST, None) == (0, 102)
+
+
+def test_count_new_discontinuities_counts_unseen_segments():
+    assert bot.count_new_discontinuities(MEDIA_PLAYLIST, 100) == (1, 102)
+    assert bot.count_new_discontinuities(MEDIA_PLAYLIST, 101) == (0, 102)
+
+
+MASTER_PLAYLIST = """#EXTM3U
+#EXT-X-VERSION:3
+#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360,CODECS="avc1.4d401e,mp4a.40.2"
+low/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=5000000,RESOLUTION=1920x1080
+https://cdn.example.com/hi.m3u8
+#EXT-X-STREAM-INF:RESOLUTION=1280x720
+broken.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=2500000
+mid.m3u8
+"""
+
+
+def test_parse_hls_master():
+    variants = bot.parse_hls_master(MASTER_PLAYLIST, "http://a.example/live/master.m3u8")
+    assert [v['bandwidth'] for v in variants] == [5_000_000, 2_500_000, 800_000]
+    assert variants[0]['url'] == "https://cdn.example.com/hi.m3u8"
+    assert variants[1]['url'] == "http://a.example/live/mid.m3u8"
+    assert variants[1]['resolution'] == ""
+    assert variants[2]['url'] == "http://a.example/live/low/index.m3u8"
+    assert variants[2]['resolution'] == "640x360"
+
+
+def test_parse_hls_master_media_playlist():
+    media = "#EXTM3U\n#EXT-X-TARGETDURATION:6\n#EXTINF:6.0,\nseg1.ts\n"
+    assert bot.parse_hls_master(media, "http://a.example/x.m3u8") == []
+
+
+DEMUXED_AUDIO_MASTER = """#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=3000000,RESOLUTION=1280x720,AUDIO="aud"
+video/720.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=1000000,RESOLUTION=640x360,AUDIO="aud-low"
+video/360.m3u8
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",NAME="English",DEFAULT=NO,URI="audio/en.m3u8"
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",NAME="Uzbek",DEFAULT=YES,URI="audio/uz.m3u8"
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud-low",NAME="Low",URI="audio/low.m3u8"
+#EXT-X-MEDIA:TYPE=SUBTITLES,GROUP-ID="subs",NAME="Sub",URI="subs/uz.m3u8"
+"""
+
+
+def test_parse_hls_master_demuxed_audio():
+    variants = bot.parse_hls_master(DEMUXED_AUDIO_MASTER, "http://a.example/live/master.m3u8")
+    assert [v['audio_url'] for v in variants] == [
+        "http://a.example/live/audio/uz.m3u8",
+        "http://a.example/live/audio/low.m3u8",
+    ]
+
+
+def test_parse_hls_master_muxed_audio_has_no_audio_url():
+    variants = bot.parse_hls_master(MASTER_PLAYLIST, "http://a.example/live/master.m3u8")
+    assert all(v['audio_url'] is None for v in variants)
+
+
+def test_ffmpeg_input_args_adds_audio_rendition():
+    variants = bot.parse_hls_master(DEMUXED_AUDIO_MASTER, "http://a.example/live/master.m3u8")
+    info = {'variants': variants, 'variant_index': 0}
+    assert bot.ffmpeg_input_args(info, "http://a.example/live/master.m3u8") == [
+        '-i', "http://a.example/live/video/720.m3u8",
+        '-i', "http://a.example/live/audio/uz.m3u8",
+        '-map', '0:v', '-map', '1:a',
+    ]
+    assert bot.ffmpeg_input_args({'variants': []}, "http://x/s.ts") == ['-i', "http://x/s.ts"]
+
+
+async def iterate(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def test_read_playlist_body_reads_all_chunks():
+    chunks = [b"#EX", b"TM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1\n", b"a.m3u8\n"]
+    body = asyncio.run(bot.read_playlist_body(iterate(chunks)))
+    assert body == b"".join(chunks)
+
+
+def test_read_playlist_body_stops_early_on_non_m3u8():
+    consumed = []
+
+    async def endless_ts():
+        while True:
+            consumed.append(1)
+            yield b"\x47" * 188
+
+    assert asyncio.run(bot.read_playlist_body(endless_ts())) is None
+    assert len(consumed) == 1
+
+
+def test_read_playlist_body_rejects_oversized(monkeypatch):
+    monkeypatch.setattr(bot, 'MAX_PLAYLIST_BYTES', 16)
+    chunks = [b"#EXTM3U\n", b"#EXTINF:6.0,\nseg1.ts\n"]
+    assert asyncio.run(bot.read_playlist_body(iterate(chunks))) is None
+
+
+def test_monitor_ffmpeg_stderr_survives_overlong_line():
+    async def scenario():
+        stderr = asyncio.StreamReader(limit=64)
+        stderr.feed_data(b"x" * 500 + b"\n")
+        stderr.feed_data(b"[hls @ 0x55] Failed to open segment 3 of playlist 0\n")
+        stderr.feed_eof()
+        info = {
+            'quality': bot.new_quality_counters(),
+            'part_quality': bot.new_quality_counters(),
+            'step_down': False,
+            'variants': [],
+        }
+        process = types.SimpleNamespace(stderr=stderr)
+        await bot.monitor_ffmpeg_stderr(process, info)
+        return info
+
+    info = asyncio.run(scenario())
+    assert info['quality']['segment_errors'] == 1
+
+
+class FakeBot:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.messages.append((chat_id, text))
+
+
+def test_monitor_loop_lag_alerts_once_within_cooldown(monkeypatch):
+    monkeypatch.setattr(bot, 'LOOP_LAG_INTERVAL', 0.01)
+    monkeypatch.setattr(bot, 'LOOP_LAG_THRESHOLD', 0.05)
+    monkeypatch.setattr(bot, 'LOOP_LAG_ALERT_COOLDOWN', 300)
+    monkeypatch.setattr(bot, 'loop_lag_stats', {'last': 0.0, 'max': 0.0})
+    fake_bot = FakeBot()
+
+    async def scenario():
+        monitor = asyncio.create_task(bot.monitor_loop_lag(fake_bot))
+        for _ in range(2):
+            await asyncio.sleep(0.03)
+            time.sleep(0.15)  # Event loop ni bloklash
+            await asyncio.sleep(0.03)
+        monitor.cancel()
+
+    asyncio.run(scenario())
+
+    assert bot.loop_lag_stats['max'] > 0.05
+    assert len(fake_bot.messages) == 1
+    assert fake_bot.messages[0][0] == bot.ADMIN_ID
+
+
+def test_run_fs_uses_fs_io_thread():
+    name = asyncio.run(bot.run_fs(lambda: threading.current_thread().name))
+    assert name.startswith("fs-io")
+
+
+class FakeProcess:
+    def __init__(self):
+        self.returncode = None
+        self.terminated = 0
+
+    def terminate(self):
+        self.terminated += 1
+
+
+def make_recording(title="Kanal", process=None, **overrides):
+    info = {
+        'title': title,
+        'policy': bot.default_split_policy(),
+        'process': process,
+        'paused': False,
+        'stopping': False,
+        'resume_event': asyncio.Event(),
+        'ingest_bps': None,
+        'cut_handle': None,
+    }
+    info.update(overrides)
+    return info
+
+
+def test_request_stop_terminates_part_once():
+    process = FakeProcess()
+    info = make_recording(process=process, paused=True)
+    bot.active_recordings['a'] = info
+
+    assert bot.request_stop('a') is True
+    assert info['stopping'] is True
+    assert info['paused'] is False
+    assert info['resume_event'].is_set()
+    assert process.terminated == 1
+
+    assert bot.request_stop('a') is False
+    assert bot.request_stop('missing') is False
+    assert process.terminated == 1
+
+
+def test_pause_and_resume_transitions():
+    process = FakeProcess()
+    info = make_recording(process=process)
+    info['resume_event'].set()
+    bot.active_recordings['a'] = info
+
+    assert bot.resume_recording('a') is False
+    assert bot.pause_recording('a') is True
+    assert info['paused'] is True
+    assert not info['resume_event'].is_set()
+    assert process.terminated == 1
+    assert bot.pause_recording('a') is False
+
+    assert bot.resume_recording('a') is True
+    assert info['paused'] is False
+    assert info['resume_event'].is_set()
+
+    info['stopping'] = True
+    assert bot.pause_recording('a') is False
+    assert bot.resume_recording('a') is False
+
+
+def start_part(info, duration_sec, elapsed):
+    info['part_started'] = time.monotonic() - elapsed
+    info['part_plan'] = {'duration_sec': duration_sec}
+
+
+def test_rebind_policy_cuts_immediately_when_part_already_too_long():
+    process = FakeProcess()
+    info = make_recording(process=process)
+    start_part(info, duration_sec=3600, elapsed=600)
+    bot.active_recordings['a'] = info
+
+    policy = bot.parse_split_policy(["duration=5"])
+    plan = bot.rebind_policy('a', policy)
+
+    assert plan['duration_sec'] == 300
+    assert info['policy'] is policy
+    assert process.terminated == 1
+    assert info['cut_handle'] is None
+
+
+def test_rebind_policy_schedules_and_replaces_cut():
+    process = FakeProcess()
+    info = make_recording(process=process)
+    start_part(info, duration_sec=3600, elapsed=60)
+    bot.active_recordings['a'] = info
+
+    async def scenario():
+        bot.rebind_policy('a', bot.parse_split_policy(["duration=30"]))
+        first = info['cut_handle']
+        assert first is not None
+        assert 1600 < first.when() - asyncio.get_running_loop().time() < 1800
+
+        bot.rebind_policy('a', bot.parse_split_policy(["duration=10"]))
+        second = info['cut_handle']
+        assert first.cancelled()
+        assert second is not first
+        assert 500 < second.when() - asyncio.get_running_loop().time() < 600
+
+        # Joriy partdan uzunroq siyosat - kesish bekor qilinadi
+        bot.rebind_policy('a', bot.parse_split_policy(["duration=120"]))
+        assert second.cancelled()
+        assert info['cut_handle'] is None
+
+    asyncio.run(scenario())
+    assert process.terminated == 0
+
+
+def test_rebind_policy_ignores_stopping_recording():
+    process = FakeProcess()
+    old_policy = bot.default_split_policy()
+    info = make_recording(process=process, policy=old_policy, stopping=True)
+    start_part(info, duration_sec=3600, elapsed=600)
+    bot.active_recordings['a'] = info
+
+    assert bot.rebind_policy('a', bot.parse_split_policy(["duration=5"])) is None
+    assert info['policy'] is old_policy
+    assert process.terminated == 0
+
+
+def test_control_targets_and_keyboard():
+    bot.active_recordings.update({
+        'run': make_recording("Run"),
+        'pau': make_recording("Pau", paused=True),
+        'stp': make_recording("Stp", stopping=True),
+    })
+
+    assert bot.control_targets('stop') == ['run', 'pau']
+    assert bot.control_targets('pause') == ['run']
+    assert bot.control_targets('resume') == ['pau']
+    assert bot.control_targets('policy') == ['run', 'pau']
+
+    stop_data = [row[0].callback_data for row in bot.recordings_keyboard('stop').inline_keyboard]
+    assert stop_data == ['stop:run', 'stop:pau', 'stop:all']
+
+    pause_data = [row[0].callback_data for row in bot.recordings_keyboard('pause').inline_keyboard]
+    assert pause_data == ['pause:run']
+
+    bot.active_recordings['pau']['stopping'] = True
+    assert bot.recordings_keyboard('resume') is None
+
+
+def test_apply_control_action_escapes_unknown_id():
+    text = bot.apply_control_action('stop', '<x&')
+    assert '&lt;x&amp;' in text
+    assert '<x' not in text
+
+
+def test_stop_recordings_staggered_sleeps_only_between_real_stops(monkeypatch):
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append((delay, sorted(k for k, v in bot.active_recordings.items() if v['stopping'])))
+
+    monkeypatch.setattr(bot.asyncio, 'sleep', fake_sleep)
+    bot.active_recordings.update({
+        'a': make_recording("A"),
+        'b': make_recording("B", stopping=True),
+        'c': make_recording("C"),
+        'd': make_recording("D"),
+    })
+
+    asyncio.run(bot.stop_recordings_staggered(['gone', 'a', 'b', 'c', 'd']))
+
+    assert all(info['stopping'] for info in bot.active_recordings.values())
+    assert delays == [
+        (bot.STOP_STAGGER_SEC, ['a', 'b']),
+        (bot.STOP_STAGGER_SEC, ['a', 'b', 'c']),
+    ]